@@ -1,9 +1,9 @@
 import streamlit as st
+import asyncio
 import os
-import time
-from pipeline import process_all_files, process_file,safe_process_file
-import viz
-import pandas as pd
+import shutil
+# pipeline/viz (and pandas with them) are imported inside the branches that use them,
+# so the Upload Data / Manual Entry pages don't pay for the dashboard imports on cold start
 
 ALLOWED_PLANTS = {f"plant_{i}" for i in range(1, 8)}
 
@@ -38,15 +38,6 @@ st.markdown("""
     font-size: 0.9em;
     color: #6c757d;
 }
-.blue-box {
-    background-color: #e6f0fa;
-    border-left: 4px solid #0072b5;
-    padding: 10px 18px;
-    border-radius: 6px;
-    margin-top: 8px;
-    margin-bottom: 12px;
-    font-size: 1em;
-}
 </style>
 """, unsafe_allow_html=True)
 
@@ -55,6 +46,23 @@ processed_data_path = 'data/processed'
 os.makedirs(raw_data_path, exist_ok=True)
 os.makedirs(processed_data_path, exist_ok=True)
 
+@st.cache_resource
+def get_mapping():
+    from pipeline import load_mapping
+    return load_mapping()
+
+async def _process_uploads(file_names, mapping):
+    from pipeline import safe_process_file
+    # Each upload is parsed in its own thread; the Excel read and file write release the GIL
+    return await asyncio.gather(*[
+        asyncio.to_thread(safe_process_file, name, raw_data_path, processed_data_path, mapping)
+        for name in file_names
+    ])
+
+@st.cache_data(ttl=2, show_spinner=False)
+def list_files(directory, suffix, dir_mtime):
+    return sorted(f for f in os.listdir(directory) if f.endswith(suffix))
+
 st.title("🏭 Factory Metrics Integration Dashboard")
 st.markdown("Unified, real-time manufacturing analytics for all plants. **Upload Excel files below to update your dashboard.**")
 
@@ -64,102 +72,127 @@ with st.sidebar:
 
     st.markdown("---")
     st.markdown("## 📂 Data Upload")
-    uploaded_file = st.file_uploader("Upload Plant Excel File", type=["xlsx"])
-    if uploaded_file:
-        with open(os.path.join(raw_data_path, uploaded_file.name), 'wb') as f:
-            f.write(uploaded_file.getbuffer())
-        st.success(f"✅ {uploaded_file.name} uploaded successfully.")
-        with st.spinner("Processing file..."):
-            time.sleep(1)
-            error = safe_process_file(uploaded_file.name)
-        if error:
-            st.error(f"❌ File not processed: {error}")
-        else:
-            st.success("File processed and saved.")
+    uploaded_files = st.file_uploader("Upload Plant Excel Files", type=["xlsx"], accept_multiple_files=True)
+    # Uploads stay in the widget across reruns, so only handle ones not seen yet
+    handled_uploads = st.session_state.setdefault('handled_uploads', set())
+    pending = [f for f in uploaded_files if f.file_id not in handled_uploads]
+    if pending:
+        for uploaded_file in pending:
+            uploaded_file.seek(0)
+            with open(os.path.join(raw_data_path, uploaded_file.name), 'wb') as f:
+                shutil.copyfileobj(uploaded_file, f, length=65536)
+            st.success(f"✅ {uploaded_file.name} uploaded successfully.")
+        with st.spinner("Processing files..."):
+            results = asyncio.run(_process_uploads([f.name for f in pending], get_mapping()))
+        for uploaded_file, (error, unmapped) in zip(pending, results):
+            if error:
+                st.error(f"❌ {uploaded_file.name} not processed: {error}")
+            else:
+                st.success(f"{uploaded_file.name} processed and saved.")
+                if unmapped:
+                    st.warning(f"⚠️ {uploaded_file.name}: {unmapped} row(s) had a missing or unrecognised shift and were kept without one.")
+            handled_uploads.add(uploaded_file.file_id)
 
-    raw_files = [f for f in os.listdir(raw_data_path) if f.endswith('.xlsx')]
-    processed_files = [f for f in os.listdir(processed_data_path) if f.endswith('_clean.csv')]
+    # Directory mtime changes whenever a file is added or removed, which invalidates the cached listing
+    raw_files = list_files(raw_data_path, '.xlsx', os.path.getmtime(raw_data_path))
+    processed_files = list_files(processed_data_path, '_clean.parquet', os.path.getmtime(processed_data_path))
 
     if raw_files:
         st.markdown("---")
         st.markdown("### 📄 Loaded Data Files")
-        for file in raw_files:
-            st.write(f"- {file}")
+        st.markdown("\n".join(f"- {file}" for file in raw_files))
 
     if processed_files:
         st.markdown("---")
         st.markdown("### 🗂️ Processed Data by Plant")
-        for file in processed_files:
-            plant_name = file.replace('_clean.csv', '')
-            st.write(f"✅ Processed: {plant_name}")
+        st.markdown("  \n".join(f"✅ Processed: {file.replace('_clean.parquet', '')}" for file in processed_files))
 
 if menu == "Dashboard":
+    from pipeline import migrate_legacy_csv, process_changed_files
+    import viz
+
     with st.spinner("Processing existing files..."):
-        time.sleep(1)
-        process_all_files()
-    st.success("All available data processed successfully.")
+        errors = migrate_legacy_csv(processed_data_path)
+        manifest, process_errors, unmapped = process_changed_files(st.session_state.get('processed_manifest', {}), mapping=get_mapping())
+        st.session_state['processed_manifest'] = manifest
+        errors.update(process_errors)
+    for file, error in errors.items():
+        st.error(f"❌ {file} not processed: {error}")
+    for file, count in unmapped.items():
+        st.warning(f"⚠️ {file}: {count} row(s) had a missing or unrecognised shift and were kept without one.")
+    if not errors:
+        st.success("All available data processed successfully.")
 
-    df = viz.load_processed_data()
+    data_key = viz.processed_files_key(processed_data_path)
+    df = viz.load_processed_data(processed_data_path, data_key)
     if not df.empty:
         tabs = st.tabs(["📊 Overall Summary", "📈 Trends & Breakdowns", "🧠 Insights"])
 
         with tabs[0]:
             st.header("📊 Overall Summary")
-            df_filtered = viz.filter_data(df)
+            df_filtered, filter_key, agg_cache_dir = viz.filter_data(df, data_key, processed_data_path)
+            # One aggregation pass shared by all four KPI cards, redone only when the filters change;
+            # reruns from unrelated widgets (smoothing toggle, navigation) reuse the session's copy
+            if st.session_state.get('kpi_filter_key') != filter_key:
+                st.session_state['kpi_totals'] = (
+                    df_filtered.agg({'bottles_produced': 'sum', 'defect_count': 'sum', 'downtime': 'mean'}),
+                    df_filtered['plant'].nunique()
+                )
+                st.session_state['kpi_filter_key'] = filter_key
+            totals, n_plants = st.session_state['kpi_totals']
 
             col1, col2, col3, col4 = st.columns(4)
             with col1:
                 st.markdown('<div class="metric-card"><div class="metric-title">Total Plants</div><div class="metric-value">{}</div><div class="metric-subtitle">Active</div></div>'.format(
-                    df_filtered['plant'].nunique()), unsafe_allow_html=True)
+                    n_plants), unsafe_allow_html=True)
             with col2:
                 st.markdown('<div class="metric-card"><div class="metric-title">Total Bottles</div><div class="metric-value">{:,}</div><div class="metric-subtitle">Produced</div></div>'.format(
-                    int(df_filtered['bottles_produced'].sum())), unsafe_allow_html=True)
+                    int(totals['bottles_produced'])), unsafe_allow_html=True)
             with col3:
-                defect_rate = (df_filtered['defect_count'].sum() / df_filtered['bottles_produced'].sum()) * 100 if df_filtered['bottles_produced'].sum() > 0 else 0
+                defect_rate = (totals['defect_count'] / totals['bottles_produced']) * 100 if totals['bottles_produced'] > 0 else 0
                 st.markdown('<div class="metric-card"><div class="metric-title">Defect Rate</div><div class="metric-value">{:.2f}%</div><div class="metric-subtitle">Rejects</div></div>'.format(
                     defect_rate), unsafe_allow_html=True)
             with col4:
-                avg_downtime = df_filtered['downtime'].mean()
+                avg_downtime = totals['downtime']
                 st.markdown('<div class="metric-card"><div class="metric-title">Avg Downtime</div><div class="metric-value">{:.1f}</div><div class="metric-subtitle">minutes</div></div>'.format(
                     avg_downtime), unsafe_allow_html=True)
 
             st.markdown("---")
             st.markdown("### Plant Comparison")
-            viz.show_plant_comparison(df_filtered)
+            viz.show_plant_comparison(df_filtered, filter_key, agg_cache_dir)
 
         with tabs[1]:
             st.header("Trends & Breakdowns")
             smoothing = st.checkbox("Show Smoothed Trend Lines", value=True)
-            data = df_filtered.copy()
 
             col1, col2 = st.columns(2)
             with col1:
                 st.markdown("**Production Trend by Date**")
-                viz.show_production_trends(data, smoothing=smoothing)
+                viz.show_production_trends(df_filtered, smoothing=smoothing, filter_key=filter_key, cache_dir=agg_cache_dir)
             with col2:
                 st.markdown("**Defect Rate Trend by Date**")
-                viz.show_defect_rate_trend(data, smoothing=smoothing)
+                viz.show_defect_rate_trend(df_filtered, smoothing=smoothing, filter_key=filter_key, cache_dir=agg_cache_dir)
 
             st.markdown("---")
             col3, col4 = st.columns(2)
             with col3:
                 st.markdown("**Downtime Trend by Date**")
-                viz.show_downtime_trend(data, smoothing=smoothing)
+                viz.show_downtime_trend(df_filtered, smoothing=smoothing, filter_key=filter_key, cache_dir=agg_cache_dir)
             with col4:
                 st.markdown("**Shift-wise Breakdown**")
-                viz.show_shift_breakdown(data)
+                viz.show_shift_breakdown(df_filtered, filter_key, agg_cache_dir)
 
             st.markdown("---")
 
         with tabs[2]:
             st.header("Insights & Highlights")
-            viz.show_kpi_insights(df_filtered)
+            viz.show_kpi_insights(df_filtered, filter_key, agg_cache_dir)
             st.markdown("**Day of Week Analysis**")
             col_a, col_b = st.columns(2)
             with col_a:
-                viz.show_dayofweek_production(data)
+                viz.show_dayofweek_production(df_filtered, filter_key)
             with col_b:
-                viz.show_dayofweek_defects(data)
+                viz.show_dayofweek_defects(df_filtered, filter_key)
 
     else:
         st.info("No processed data to display. Please upload plant data files.")
@@ -185,6 +218,9 @@ elif menu == "Manual Entry":
         submitted = st.form_submit_button("Submit Entry")
 
     if submitted:
+        import pandas as pd
+        from pipeline import DAYS_OF_WEEK, SHIFT_MAP, SHIFTS
+
         # Prevent invalid numbers
         if bottles_produced < 1:
             st.error("Bottles produced must be at least 1.")
@@ -198,34 +234,41 @@ elif menu == "Manual Entry":
         else:
             try:
                 # Standardise shift
-                shift_map = {'1': 'A', '2': 'B', '3': 'C', 'A': 'A', 'B': 'B', 'C': 'C'}
-                shift_std = shift_map.get(str(shift), shift)
-                day_of_week = pd.to_datetime(str(date)).day_name()
-                entry = pd.DataFrame([{
-                    "date": date,
+                shift_std = SHIFT_MAP.get(str(shift), shift)
+                day_of_week = DAYS_OF_WEEK[date.weekday()]
+                row = {
+                    "date": pd.Timestamp(date),
                     "shift": shift_std,
                     "bottles_produced": bottles_produced,
                     "defect_count": defect_count,
                     "downtime": downtime,
                     "day_of_week": day_of_week
-                }])
-                processed_file = os.path.join(processed_data_path, f"{plant}_clean.csv")
-                duplicate = False
-                if os.path.exists(processed_file):
-                    existing = pd.read_csv(processed_file, parse_dates=['date'])
-                    duplicate = (
-                        (existing['date'].astype(str) == str(date)) &
-                        (existing['shift'] == shift_std)
-                    ).any()
+                }
+                processed_file = os.path.join(processed_data_path, f"{plant}_clean.parquet")
+                # Read the plant file once and reuse it for the duplicate check and the preview
+                existing = pd.read_parquet(processed_file, engine='pyarrow') if os.path.exists(processed_file) else None
+                duplicate = existing is not None and (
+                    (existing['date'] == row['date']) &
+                    (existing['shift'] == shift_std)
+                ).any()
                 if duplicate:
                     st.warning(f"An entry for {plant} on {date}, shift {shift_std} already exists. Not added.")
                 else:
-                    entry.to_csv(processed_file, mode='a' if os.path.exists(processed_file) else 'w',
-                                 header=not os.path.exists(processed_file), index=False)
+                    # Append the single row in place rather than building a one-row frame to concat
+                    if existing is not None:
+                        out = existing
+                        out.loc[len(out)] = row
+                    else:
+                        out = pd.DataFrame([row])
+                    # Appending a plain row leaves shift and day_of_week as object columns; restore
+                    # the categoricals process_file writes so the plant file keeps one schema
+                    out['shift'] = pd.Categorical(out['shift'], categories=SHIFTS)
+                    out['day_of_week'] = pd.Categorical(out['day_of_week'], categories=DAYS_OF_WEEK, ordered=True)
+                    out.to_parquet(processed_file, engine='pyarrow', compression='zstd', index=False)
                     st.success(f"Entry added for {plant} on {date}, shift {shift_std}.")
                     st.balloons()
                     # Show last 5 entries for that plant
-                    recent = pd.read_csv(processed_file, parse_dates=['date']).sort_values('date', ascending=False).head(5)
+                    recent = out.sort_values('date', ascending=False).head(5)
                     st.markdown("#### Last 5 Entries for this Plant")
                     st.dataframe(recent, use_container_width=True)
             except Exception as e:
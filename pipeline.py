@@ -1,59 +1,152 @@
 import os
 import pandas as pd
 import json
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = 'openpyxl'
 
 ALLOWED_PLANTS = {f"plant_{i}" for i in range(1, 8)}
+REQUIRED_COLUMNS = {'date', 'shift', 'bottles_produced', 'defect_count', 'downtime'}
 
+@lru_cache(maxsize=1)
 def load_mapping():
     with open('config/mapping.json', 'r') as f:
         return json.load(f)
 
+DAYS_OF_WEEK = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+SHIFT_MAP = {'1': 'A', '2': 'B', '3': 'C', 'A': 'A', 'B': 'B', 'C': 'C'}
+SHIFTS = ['A', 'B', 'C']
+SHIFT_CODES = {k: SHIFTS.index(v) for k, v in SHIFT_MAP.items()}
+
 def standardise_shifts(df):
-    shift_map = {'1': 'A', '2': 'B', '3': 'C', 1: 'A', 2: 'B', 3: 'C', 'A': 'A', 'B': 'B', 'C': 'C'}
     if 'shift' in df.columns:
-        df['shift'] = df['shift'].astype(str).map(shift_map).fillna(df['shift'])
+        # Normalise each distinct raw value once, then build the categorical straight from codes;
+        # unrecognised values get code -1 (missing) rather than failing the whole file
+        inverse, uniques = pd.factorize(df['shift'], use_na_sentinel=False)
+        lookup = pd.Index(uniques).astype(str).str.strip().str.upper().str.removesuffix('.0').map(lambda s: SHIFT_CODES.get(s, -1))
+        df['shift'] = pd.Categorical.from_codes(lookup.to_numpy('int8')[inverse], categories=SHIFTS)
     return df
 
-def process_file(file_name, raw_data_path='data/raw', processed_data_path='data/processed'):
-    mapping = load_mapping()
+def process_file(file_name, raw_data_path='data/raw', processed_data_path='data/processed', mapping=None):
+    if mapping is None:
+        mapping = load_mapping()
 
     base_name = os.path.splitext(file_name)[0].lower()
     if base_name not in mapping or base_name not in ALLOWED_PLANTS:
         raise ValueError(f"Unknown or not-allowed plant: {base_name}. Allowed: {', '.join(sorted(ALLOWED_PLANTS))}")
 
-    # Read and clean data
-    df = pd.read_excel(os.path.join(raw_data_path, file_name))
-    df = df.rename(columns={k: v for k, v in mapping[base_name].items() if k in df.columns})
-    # Lowercase columns
-    df.columns = [c.lower() for c in df.columns]
+    # Read and clean data (only the mapped columns are parsed)
+    wanted = set(mapping[base_name]) | REQUIRED_COLUMNS
+    df = pd.read_excel(
+        os.path.join(raw_data_path, file_name), sheet_name=0, engine=EXCEL_ENGINE,
+        usecols=lambda c: c in wanted or str(c).lower() in wanted
+    )
+    # Map known headers and lowercase the rest in a single rename
+    columns = mapping[base_name]
+    df = df.rename(columns=lambda c: str(columns.get(c, c)).lower())
     # Add day of week
     if 'date' in df.columns:
         df['date'] = pd.to_datetime(df['date'])
-        df['day_of_week'] = df['date'].dt.day_name()
+        # Weekday codes (Monday=0) straight into a categorical; no per-row name strings
+        df['day_of_week'] = pd.Categorical.from_codes(
+            df['date'].dt.dayofweek.fillna(-1).astype('int8'), categories=DAYS_OF_WEEK, ordered=True
+        )
     df = standardise_shifts(df)
 
-    required_cols = {'date', 'shift', 'bottles_produced', 'defect_count', 'downtime', 'day_of_week'}
+    required_cols = REQUIRED_COLUMNS | {'day_of_week'}
     missing = required_cols - set(df.columns)
     if missing:
         raise ValueError(f"Missing columns in file {file_name}: {missing}")
 
-    df.to_csv(os.path.join(processed_data_path, f"{base_name}_clean.csv"), index=False)
+    df.to_parquet(os.path.join(processed_data_path, f"{base_name}_clean.parquet"), engine='pyarrow', compression='zstd', index=False)
+    # Rows whose shift was blank or not recognised are kept with a missing shift; report how many
+    return int(df['shift'].isna().sum())
+
+def process_files(files, raw_data_path='data/raw', processed_data_path='data/processed', mapping=None):
+    # Plant files are independent, so parse them in parallel worker processes; a bad file is
+    # reported in the returned {file: error} dict instead of stopping the others, and files
+    # with rows lacking a recognised shift in {file: row count}
+    if mapping is None:
+        mapping = load_mapping()
+    n = len(files)
+    if n <= 1:
+        results = [safe_process_file(file, raw_data_path, processed_data_path, mapping) for file in files]
+    else:
+        with ProcessPoolExecutor(max_workers=min(n, os.cpu_count() or 1)) as ex:
+            results = list(ex.map(safe_process_file, files, [raw_data_path] * n, [processed_data_path] * n, [mapping] * n))
+    errors = {file: error for file, (error, _) in zip(files, results) if error}
+    unmapped = {file: count for file, (_, count) in zip(files, results) if count}
+    return errors, unmapped
+
+def is_up_to_date(file_name, raw_data_path='data/raw', processed_data_path='data/processed'):
+    base_name = os.path.splitext(file_name)[0].lower()
+    clean_path = os.path.join(processed_data_path, f"{base_name}_clean.parquet")
+    return (os.path.exists(clean_path)
+            and os.path.getmtime(clean_path) >= os.path.getmtime(os.path.join(raw_data_path, file_name)))
 
-def process_all_files(raw_data_path='data/raw', processed_data_path='data/processed'):
-    processed_count = 0
+def process_all_files(raw_data_path='data/raw', processed_data_path='data/processed', mapping=None, force=False):
+    files = [f for f in raw_file_manifest(raw_data_path)
+             if force or not is_up_to_date(f, raw_data_path, processed_data_path)]
+    return process_files(files, raw_data_path, processed_data_path, mapping)
+
+def raw_file_manifest(raw_data_path='data/raw'):
+    manifest = {}
     for file in os.listdir(raw_data_path):
         if file.lower().endswith('.xlsx'):
             base_name = os.path.splitext(file)[0].lower()
             if base_name in ALLOWED_PLANTS:
-                process_file(file, raw_data_path, processed_data_path)
-                processed_count += 1
-    return processed_count
-def safe_process_file(file_name, raw_data_path='data/raw', processed_data_path='data/processed'):
+                stat = os.stat(os.path.join(raw_data_path, file))
+                manifest[file] = (stat.st_mtime, stat.st_size)
+    return manifest
+
+def process_changed_files(previous_manifest, raw_data_path='data/raw', processed_data_path='data/processed', mapping=None):
+    # Files unchanged since the last run in this session are skipped outright; otherwise
+    # a processed output newer than its source (e.g. from an earlier session) is reused
+    manifest = raw_file_manifest(raw_data_path)
+    changed = []
+    for file, signature in manifest.items():
+        base_name = os.path.splitext(file)[0].lower()
+        clean_path = os.path.join(processed_data_path, f"{base_name}_clean.parquet")
+        if previous_manifest.get(file) == signature and os.path.exists(clean_path):
+            continue
+        if not is_up_to_date(file, raw_data_path, processed_data_path):
+            changed.append(file)
+    errors, unmapped = process_files(changed, raw_data_path, processed_data_path, mapping)
+    # Failed files stay out of the manifest so they are retried (and reported) on the next run
+    for file in errors:
+        del manifest[file]
+    return manifest, errors, unmapped
+
+def migrate_legacy_csv(processed_data_path='data/processed'):
+    # Processed data used to be written as *_clean.csv (manual entries included); convert any
+    # that have no Parquet counterpart yet so they aren't re-derived from the raw files. Shifts
+    # are standardised like process_file's output; a file that fails is left as is and reported
+    # in the returned {file: error} dict
+    errors = {}
+    for file in os.listdir(processed_data_path):
+        if file.endswith('_clean.csv'):
+            parquet_path = os.path.join(processed_data_path, file.replace('_clean.csv', '_clean.parquet'))
+            if not os.path.exists(parquet_path):
+                try:
+                    df = standardise_shifts(pd.read_csv(os.path.join(processed_data_path, file), parse_dates=['date']))
+                    df.to_parquet(parquet_path, engine='pyarrow', compression='zstd', index=False)
+                except ValueError as e:
+                    errors[file] = str(e)
+                except Exception as ex:
+                    errors[file] = f"Unexpected error: {ex}"
+    return errors
+
+def safe_process_file(file_name, raw_data_path='data/raw', processed_data_path='data/processed', mapping=None):
+    # (error or None, number of rows without a recognised shift)
     try:
-        process_file(file_name, raw_data_path, processed_data_path)
-        return None 
+        return None, process_file(file_name, raw_data_path, processed_data_path, mapping)
     except ValueError as e:
-        return str(e)
+        return str(e), 0
     except Exception as ex:
-        return f"Unexpected error: {ex}"
+        return f"Unexpected error: {ex}", 0
 
@@ -1,34 +1,122 @@
+import hashlib
 import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import streamlit as st
 import plotly.express as px
+import plotly.graph_objects as go
+from pipeline import ALLOWED_PLANTS, DAYS_OF_WEEK, SHIFTS
 
-def load_processed_data(processed_data_path='data/processed'):
-    all_data = []
-    for file in os.listdir(processed_data_path):
-        if file.endswith('_clean.csv'):
-            df = pd.read_csv(os.path.join(processed_data_path, file))
-            df['plant'] = file.replace('_clean.csv', '')
-            all_data.append(df)
-    if all_data:
-        combined = pd.concat(all_data, ignore_index=True)
-        combined['date'] = pd.to_datetime(combined['date'])
+def processed_files_key(processed_data_path='data/processed'):
+    return tuple(sorted(
+        (f, os.path.getmtime(os.path.join(processed_data_path, f)))
+        for f in os.listdir(processed_data_path) if f.endswith('_clean.parquet')
+    ))
+
+def load_processed_data(processed_data_path='data/processed', files_key=None):
+    # (file, mtime) pairs are the cache key, so any new or rewritten file invalidates the cache
+    if files_key is None:
+        files_key = processed_files_key(processed_data_path)
+    return _load_processed(processed_data_path, files_key)
+
+DICTIONARY_COLUMNS = ['shift', 'day_of_week']
+
+def _processed_schema(paths):
+    # One schema for the whole scan: numeric columns widened where files disagree (int vs float
+    # downtime), and the low-cardinality text columns as dictionaries even where older outputs
+    # stored them as plain strings
+    schemas = []
+    for path in paths:
+        schema = pq.read_schema(path)
+        for name in DICTIONARY_COLUMNS:
+            if name in schema.names:
+                schema = schema.set(schema.get_field_index(name), pa.field(name, pa.dictionary(pa.int32(), pa.string())))
+        schemas.append(schema)
+    return pa.unify_schemas(schemas, promote_options='permissive')
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _load_processed(processed_data_path, files_key):
+    if files_key:
+        paths = [os.path.join(processed_data_path, file) for file, _ in files_key]
+        # A single multi-file dataset scan: Arrow reads the plant files on its own threads into one table
+        file_format = ds.ParquetFileFormat(read_options=ds.ParquetReadOptions(dictionary_columns=DICTIONARY_COLUMNS))
+        dataset = ds.dataset(paths, schema=_processed_schema(paths), format=file_format)
+        table = dataset.to_table()
+        # Plant name per row as dictionary codes: file i's rows get code i (scan keeps file order)
+        counts = [fragment.count_rows() for fragment in dataset.get_fragments()]
+        plant = pa.DictionaryArray.from_arrays(
+            pa.array(np.repeat(np.arange(len(paths), dtype='int8'), counts)),
+            pa.array([file.replace('_clean.parquet', '') for file, _ in files_key])
+        )
+        combined = table.append_column('plant', plant).to_pandas()
+        # Date-sorted rows let filter_data cut the date range with a binary search
+        combined = combined.sort_values('date', kind='stable', ignore_index=True)
+        # Few distinct values, so store as categories (int codes) to cut memory and speed up filters/groupbys;
+        # fixed category sets keep plant and shift codes stable across uploads (not in whatever order the
+        # data first holds them) and sort weekdays Monday..Sunday
+        combined['shift'] = combined['shift'].astype('category').cat.set_categories(SHIFTS)
+        combined['plant'] = combined['plant'].cat.set_categories(sorted(ALLOWED_PLANTS))
+        combined['day_of_week'] = pd.Categorical(combined['day_of_week'], categories=DAYS_OF_WEEK, ordered=True)
+        combined['month_code'] = _month_codes(combined)
+        # Counts to the narrowest signed int that holds them (exact, and signed so differences can't
+        # wrap around); downtime stays float64 so its means and sums keep full precision
+        for col in ('bottles_produced', 'defect_count'):
+            combined[col] = pd.to_numeric(combined[col], downcast='integer')
         return combined
     return pd.DataFrame()
 
-def filter_data(df):
-    plants = df['plant'].unique()
+def _month_codes(df):
+    # Calendar month as int YYYYMM: integer group keys, formatted only on the grouped result
+    if 'month_code' in df.columns:
+        return df['month_code']
+    return (df['date'].dt.year * 100 + df['date'].dt.month).fillna(0).astype('int32')
+
+def _month_labels(codes):
+    return [f"{c // 100}-{c % 100:02d}" for c in np.asarray(codes).tolist()]
+
+@st.cache_data(show_spinner=False)
+def _filter_options(_df, data_key):
+    # Widget options and date bounds scan the full frame, so they are worked out once per dataset;
+    # rows whose shift wasn't recognised (missing) are not offered as an option
+    return _df['plant'].unique().tolist(), _df['shift'].dropna().unique().tolist(), _df['date'].min(), _df['date'].max()
+
+def filter_data(df, data_key, processed_data_path='data/processed'):
+    plants, shifts, date_min, date_max = _filter_options(df, data_key)
     selected_plants = st.multiselect("Select Plants", plants, default=plants)
-    shifts = df['shift'].unique()
     selected_shifts = st.multiselect("Select Shifts", shifts, default=shifts)
-    date_range = st.date_input("Select Date Range", [df['date'].min(), df['date'].max()])
-    filtered_df = df[
-        (df['plant'].isin(selected_plants)) &
-        (df['shift'].isin(selected_shifts)) &
-        (df['date'] >= pd.to_datetime(date_range[0])) &
-        (df['date'] <= pd.to_datetime(date_range[1]))
-    ]
-    return filtered_df
+    date_range = st.date_input("Select Date Range", [date_min, date_max])
+    # filter_key identifies the filtered frame (dataset + selections) for the cached aggregations below
+    filter_key = (data_key, tuple(sorted(selected_plants)), tuple(sorted(selected_shifts)), tuple(date_range))
+    rows = _filter_rows(df, data_key, tuple(selected_plants), tuple(selected_shifts), tuple(date_range))
+    # Only row positions are cached; an uncut plant/shift selection stays a slice (no column copies)
+    filtered_df = df.iloc[rows] if isinstance(rows, slice) else df.take(rows)
+    # Only aggregates of the whole dataset are persisted to disk (see _persisted); with rows
+    # filtered out there is no cache directory and they stay in memory
+    cache_dir = os.path.join(processed_data_path, 'agg_cache') if len(filtered_df) == len(df) else None
+    return filtered_df, filter_key, cache_dir
+
+@st.cache_data(show_spinner=False)
+def _filter_rows(_df, data_key, selected_plants, selected_shifts, date_range):
+    # _df is not hashed by Streamlit; data_key identifies which loaded dataset it is
+    # Rows are sorted by date at load, so the date range is a positional slice and
+    # only the plant/shift masks run over the remaining rows
+    dates = _df['date'].to_numpy()
+    lo = dates.searchsorted(np.datetime64(date_range[0], 'ns'), side='left')
+    hi = dates.searchsorted(np.datetime64(date_range[1], 'ns'), side='right')
+    df = _df.iloc[lo:hi]
+    mask = _in_categories(df['plant'], selected_plants)
+    mask &= _in_categories(df['shift'], selected_shifts)
+    if mask.all():
+        return slice(lo, hi)
+    return lo + np.flatnonzero(mask)
+
+def _in_categories(column, selected):
+    # Selected names become category codes once; the per-row test is an int8 np.isin
+    codes = column.cat.categories.get_indexer(list(selected))
+    return np.isin(column.cat.codes.to_numpy(), codes[codes >= 0])
 
 def _delta_phrase(val, avg, unit=""):
     pct = ((val - avg) / avg) * 100 if avg else 0
@@ -48,93 +136,220 @@ def _delta_phrase(val, avg, unit=""):
         return f"{val:,.1f}{unit}, a bit below average"
     return f"{val:,.1f}{unit}"
 
-### --- Main Plots ---
+# Every chart sums the same three measures, so one cached groupby per key ('date'/'shift'/'plant',
+# date x plant for the daily leaders) serves all of them instead of one per column subset
+SUM_COLUMNS = ('bottles_produced', 'defect_count', 'downtime')
+
+def _sum_by(df, by, columns):
+    return df.groupby(by, as_index=False, observed=True)[list(columns)].sum()
+
+# Bump when an aggregate's computation changes, so files written by older code are not read back
+AGG_CACHE_VERSION = 1
+
+def _key_hash(key):
+    return hashlib.sha1(repr(key).encode()).hexdigest()[:12]
+
+def _persisted(name, df, data_key, cache_dir, compute):
+    # Aggregates of the whole dataset also outlive the process as small Parquet files in cache_dir,
+    # so a restart reads O(days) rows instead of regrouping. The file name carries AGG_CACHE_VERSION
+    # and a hash of the dataset version (data_key) and the input columns and dtypes, so new data or a
+    # changed loader never reads back an old frame; older files of the same aggregate are removed
+    if cache_dir is None:
+        return compute()
+    path = os.path.join(cache_dir, f"{name}_v{AGG_CACHE_VERSION}_{_key_hash((data_key, tuple(df.dtypes.astype(str).items())))}.parquet")
+    if os.path.exists(path):
+        try:
+            return pd.read_parquet(path, engine='pyarrow')
+        except (OSError, pa.ArrowException):
+            pass  # unreadable (e.g. partly written) file: recompute and overwrite it
+    result = compute()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for file in os.listdir(cache_dir):
+            if file.rsplit('_', 2)[0] == name and file != os.path.basename(path):
+                os.remove(os.path.join(cache_dir, file))
+        result.to_parquet(path, engine='pyarrow', index=False)
+    except OSError:
+        pass
+    return result
+
+@st.cache_data(show_spinner=False)
+def _cached_sum_by(_df, filter_key, by, columns, cache_dir):
+    # Keys and summed columns both go in the name: sum_<key+key>_<col+col+...>
+    name = f"sum_{'+'.join([by] if isinstance(by, str) else by)}_{'+'.join(columns)}"
+    return _persisted(name, _df, filter_key[0], cache_dir, lambda: _sum_by(_df, by, columns))
+
+def _grouped_sums(df, by, columns, filter_key=None, cache_dir=None):
+    # Group sums are cached on filter_key so reruns with unchanged filters skip the groupby;
+    # without a key (ad-hoc callers) they are computed directly
+    if filter_key is None:
+        return _sum_by(df, by, columns)
+    return _cached_sum_by(df, filter_key, by, tuple(columns), cache_dir)
+
+def _daily_frame(df):
+    # Daily sums, defect rate and every 7-day smoothing line in one pass, shared by the trend charts
+    daily = _sum_by(df, 'date', SUM_COLUMNS)
+    daily['defect_rate'] = _defect_rate(daily)
+    for col in ('bottles_produced', 'defect_rate', 'downtime'):
+        daily[f'{col}_7d'] = _rolling_mean(daily[col])
+    return daily
+
+@st.cache_data(show_spinner=False)
+def _cached_daily_frame(_df, filter_key, cache_dir):
+    return _persisted('daily', _df, filter_key[0], cache_dir, lambda: _daily_frame(_df))
 
-def show_production_trends(df, smoothing=True):
-    grouped = df.groupby('date', as_index=False)['bottles_produced'].sum()
-    fig = px.line(grouped, x='date', y='bottles_produced', title='Production Trend', labels={'bottles_produced': 'Bottles Produced'})
+def _daily_totals(df, filter_key=None, cache_dir=None):
+    if filter_key is None:
+        return _daily_frame(df)
+    return _cached_daily_frame(df, filter_key, cache_dir)
+
+def _dow_means(df):
+    # Both weekday charts' means in one groupby over the filtered rows
+    return df.groupby('day_of_week', observed=False)[['bottles_produced', 'defect_count']].mean()
+
+@st.cache_data(show_spinner=False)
+def _cached_dow_means(_df, filter_key):
+    return _dow_means(_df)
+
+def _weekday_means(df, filter_key=None):
+    if filter_key is None:
+        return _dow_means(df)
+    return _cached_dow_means(df, filter_key)
+
+def _defect_rate(grouped):
+    # Percent defects into one preallocated array (divide in place, then scale); 0 where nothing was produced
+    bottles = grouped['bottles_produced'].to_numpy(dtype=np.float64)
+    rate = np.zeros(len(bottles))
+    np.divide(grouped['defect_count'].to_numpy(dtype=np.float64), bottles, out=rate, where=bottles > 0)
+    rate *= 100
+    return rate
+
+def _rolling_mean(values, window=7):
+    # Trailing mean via one cumulative sum (same result as rolling(window, min_periods=1).mean())
+    x = np.asarray(values, dtype=np.float64)
+    csum = np.cumsum(x)
+    csum[window:] = csum[window:] - csum[:-window]
+    return csum / np.minimum(np.arange(1, len(x) + 1), window)
+
+def _lttb_indices(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: per bucket keep the point forming the largest triangle with
+    # the previously kept point and the next bucket's average, so peaks and dips survive
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt = slice(hi, edges[i + 2] if i + 2 < len(edges) else n)
+        cx, cy = x[nxt].mean(), y[nxt].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+TREND_MAX_POINTS = 1000
+
+def _trend_fig(grouped, col, title, ylabel, smoothing):
+    dates = grouped['date'].to_numpy()
+    values = grouped[col].to_numpy(dtype=np.float64)
+    # Long ranges are thinned to TREND_MAX_POINTS before they reach the browser; the 7-day
+    # column (from _daily_frame) is over the full series and sampled at the same dates
+    keep = _lttb_indices(dates.astype(np.int64).astype(np.float64), values, TREND_MAX_POINTS)
+    # Traces and layout go straight into go.Figure, skipping px.line's frame reshaping;
+    # WebGL traces: long daily series redraw on a canvas instead of as SVG paths
+    traces = [go.Scattergl(x=dates[keep], y=values[keep], mode='lines', name=ylabel, showlegend=False)]
     if smoothing:
-        grouped['7-day Avg'] = grouped['bottles_produced'].rolling(window=7, min_periods=1).mean()
-        fig.add_scatter(x=grouped['date'], y=grouped['7-day Avg'], mode='lines', name='7-day Avg', line=dict(dash='dash'))
+        traces.append(go.Scattergl(x=dates[keep], y=grouped[f'{col}_7d'].to_numpy()[keep], mode='lines', name='7-day Avg', line=dict(dash='dash')))
+    return go.Figure(data=traces, layout=dict(title=title, xaxis_title='date', yaxis_title=ylabel))
+
+def _extremes(values, labels):
+    # mean/max/min and the labels at the max/min from one ndarray each (NaN-skipping like idxmax)
+    vals = np.asarray(values, dtype=np.float64)
+    hi, lo = np.nanargmax(vals), np.nanargmin(vals)
+    return np.nanmean(vals), vals[hi], vals[lo], labels[hi], labels[lo]
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def _cached_figure(chart, key, _build):
+    return _build()
+
+def _figure(chart, filter_key, build, *options):
+    # Built figures are reused while the filters (and chart options) are unchanged; they are
+    # shared across sessions, so callers only render them and never modify them afterwards
+    if filter_key is None:
+        return build()
+    return _cached_figure(chart, (filter_key, options), build)
+
+### --- Main Plots ---
+
+def show_production_trends(df, smoothing=True, filter_key=None, cache_dir=None):
+    grouped = _daily_totals(df, filter_key, cache_dir)
+    fig = _figure('production_trend', filter_key, lambda: _trend_fig(grouped, 'bottles_produced', 'Production Trend', 'Bottles Produced', smoothing), smoothing)
     st.plotly_chart(fig, use_container_width=True)
-    avg_val = grouped['bottles_produced'].mean()
-    max_val = grouped['bottles_produced'].max()
-    min_val = grouped['bottles_produced'].min()
-    max_date = grouped.loc[grouped['bottles_produced'].idxmax(), 'date']
-    min_date = grouped.loc[grouped['bottles_produced'].idxmin(), 'date']
+    avg_val, max_val, min_val, max_date, min_date = _extremes(grouped['bottles_produced'], grouped['date'].array)
     st.info(
         f"**Average daily production:** {avg_val:,.0f} bottles.  \n"
         f"**Maximum:** {_delta_phrase(max_val, avg_val, ' bottles')} (on {max_date.strftime('%b %d, %Y')}).  \n"
         f"**Minimum:** {_delta_phrase(min_val, avg_val, ' bottles')} (on {min_date.strftime('%b %d, %Y')})."
     )
 
-def show_defect_rate_trend(df, smoothing=True):
-    grouped = df.groupby('date').agg({'defect_count': 'sum', 'bottles_produced': 'sum'}).reset_index()
-    grouped['defect_rate'] = (grouped['defect_count'] / grouped['bottles_produced']) * 100
-    fig = px.line(grouped, x='date', y='defect_rate', title='Defect Rate Trend', labels={'defect_rate': 'Defect Rate (%)'})
-    if smoothing:
-        grouped['7-day Avg'] = grouped['defect_rate'].rolling(window=7, min_periods=1).mean()
-        fig.add_scatter(x=grouped['date'], y=grouped['7-day Avg'], mode='lines', name='7-day Avg', line=dict(dash='dash'))
+def show_defect_rate_trend(df, smoothing=True, filter_key=None, cache_dir=None):
+    grouped = _daily_totals(df, filter_key, cache_dir)
+    fig = _figure('defect_rate_trend', filter_key, lambda: _trend_fig(grouped, 'defect_rate', 'Defect Rate Trend', 'Defect Rate (%)', smoothing), smoothing)
     st.plotly_chart(fig, use_container_width=True)
-    avg_val = grouped['defect_rate'].mean()
-    max_val = grouped['defect_rate'].max()
-    min_val = grouped['defect_rate'].min()
-    max_date = grouped.loc[grouped['defect_rate'].idxmax(), 'date']
-    min_date = grouped.loc[grouped['defect_rate'].idxmin(), 'date']
+    avg_val, max_val, min_val, max_date, min_date = _extremes(grouped['defect_rate'], grouped['date'].array)
     st.info(
         f"**Average defect rate:** {avg_val:.2f}%.  \n"
         f"**Highest:** {_delta_phrase(max_val, avg_val, '%')} (on {max_date.strftime('%b %d, %Y')}).  \n"
         f"**Lowest:** {_delta_phrase(min_val, avg_val, '%')} (on {min_date.strftime('%b %d, %Y')})."
     )
 
-def show_downtime_trend(df, smoothing=True):
-    grouped = df.groupby('date', as_index=False)['downtime'].sum()
-    fig = px.line(grouped, x='date', y='downtime', title='Downtime Trend', labels={'downtime': 'Downtime (mins)'})
-    if smoothing:
-        grouped['7-day Avg'] = grouped['downtime'].rolling(window=7, min_periods=1).mean()
-        fig.add_scatter(x=grouped['date'], y=grouped['7-day Avg'], mode='lines', name='7-day Avg', line=dict(dash='dash'))
+def show_downtime_trend(df, smoothing=True, filter_key=None, cache_dir=None):
+    grouped = _daily_totals(df, filter_key, cache_dir)
+    fig = _figure('downtime_trend', filter_key, lambda: _trend_fig(grouped, 'downtime', 'Downtime Trend', 'Downtime (mins)', smoothing), smoothing)
     st.plotly_chart(fig, use_container_width=True)
-    avg_val = grouped['downtime'].mean()
-    max_val = grouped['downtime'].max()
-    min_val = grouped['downtime'].min()
-    max_date = grouped.loc[grouped['downtime'].idxmax(), 'date']
-    min_date = grouped.loc[grouped['downtime'].idxmin(), 'date']
+    avg_val, max_val, min_val, max_date, min_date = _extremes(grouped['downtime'], grouped['date'].array)
     st.info(
         f"**Average daily downtime:** {avg_val:.1f} mins.  \n"
         f"**Maximum:** {_delta_phrase(max_val, avg_val, ' mins')} (on {max_date.strftime('%b %d, %Y')}).  \n"
         f"**Minimum:** {_delta_phrase(min_val, avg_val, ' mins')} (on {min_date.strftime('%b %d, %Y')})."
     )
 
-def show_shift_breakdown(df):
+def show_shift_breakdown(df, filter_key=None, cache_dir=None):
     st.subheader("Shift-wise Defect % Breakdown")
-    grouped = df.groupby('shift').agg({'bottles_produced': 'sum', 'defect_count': 'sum'}).reset_index()
-    grouped['Defect %'] = (grouped['defect_count'] / grouped['bottles_produced']) * 100
-    fig = px.bar(
-        grouped, x='shift', y='Defect %',
-        title='Defect % by Shift',
-        labels={'shift': 'Shift', 'Defect %': 'Defect Percentage (%)'},
-        color='shift', color_discrete_sequence=px.colors.qualitative.Dark24
-    )
-    fig.update_traces(text=grouped['Defect %'].round(2).astype(str) + '%', textposition='outside')
+    grouped = _grouped_sums(df, 'shift', SUM_COLUMNS, filter_key, cache_dir)
+    grouped['Defect %'] = _defect_rate(grouped)
+    def build():
+        fig = px.bar(
+            grouped, x='shift', y='Defect %',
+            title='Defect % by Shift',
+            labels={'shift': 'Shift', 'Defect %': 'Defect Percentage (%)'},
+            color='shift', color_discrete_sequence=px.colors.qualitative.Dark24
+        )
+        fig.update_traces(text=grouped['Defect %'].round(2).astype(str) + '%', textposition='outside')
+        return fig
+    fig = _figure('shift_breakdown', filter_key, build)
     st.plotly_chart(fig, use_container_width=True)
-    max_shift = grouped.loc[grouped['Defect %'].idxmax(), 'shift']
-    min_shift = grouped.loc[grouped['Defect %'].idxmin(), 'shift']
-    max_val = grouped['Defect %'].max()
-    min_val = grouped['Defect %'].min()
-    avg_val = grouped['Defect %'].mean()
+    avg_val, max_val, min_val, max_shift, min_shift = _extremes(grouped['Defect %'], grouped['shift'].to_numpy())
     st.info(
         f"**Shift {max_shift}** has the highest defect rate at {max_val:.2f}%, "
         f"which is {((max_val-avg_val)/avg_val)*100:.1f}% above the shift average.  "
         f"**Shift {min_shift}** has the lowest at {min_val:.2f}%."
     )
 
-def show_heatmap_defect_rates(df):
+def show_heatmap_defect_rates(df, filter_key=None, cache_dir=None):
     st.subheader("Defect Rates by Plant and Shift")
-    pivot = df.pivot_table(index='plant', columns='shift', values='defect_count', aggfunc='sum').fillna(0)
-    fig = px.imshow(
-        pivot, text_auto=True, aspect="auto", color_continuous_scale='Reds',
-        labels={'color': 'Defects'}, title="Total Defects by Plant & Shift"
-    )
+    sums = _grouped_sums(df, ['plant', 'shift'], SUM_COLUMNS, filter_key, cache_dir)
+    pivot = sums.set_index(['plant', 'shift'])['defect_count'].unstack(fill_value=0)
+    def build():
+        fig = px.imshow(
+            pivot, text_auto=True, aspect="auto", color_continuous_scale='Reds',
+            labels={'color': 'Defects'}, title="Total Defects by Plant & Shift"
+        )
+        return fig
+    fig = _figure('defect_heatmap', filter_key, build)
     st.plotly_chart(fig, use_container_width=True)
     
     # 1. Worst single plant-shift combination
@@ -152,216 +367,201 @@ def show_heatmap_defect_rates(df):
         f"**Most problematic shift overall:** Shift {shift_max} had the highest total defects across all plants."
     )
 
-
-
-def show_dayofweek_production(df):
-    dow_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    prod = df.groupby('day_of_week')['bottles_produced'].mean().reindex(dow_order)
-    fig1 = px.bar(
-        x=prod.index, y=prod.values, 
-        labels={'x': 'Day of Week', 'y': 'Avg Bottles Produced'},
-        title="Avg Production by Day",
-        color=prod.index, color_discrete_sequence=px.colors.qualitative.Bold,
-        category_orders={'x': dow_order}
-    )
-    fig1.update_xaxes(type='category', categoryorder='array', categoryarray=dow_order)
-
-    st.plotly_chart(fig1, use_container_width=True)
-    max_prod_day = prod.idxmax()
-    min_prod_day = prod.idxmin()
-    st.info(f"Production is highest on {max_prod_day} and lowest on {min_prod_day}.")
-
-def show_plant_comparison(df):
+def show_plant_comparison(df, filter_key=None, cache_dir=None):
     st.subheader("Who Led Production Each Day?")
-    daily_prod = df.groupby(['date', 'plant'])['bottles_produced'].sum().reset_index()
-    daily_prod['leader'] = (daily_prod.groupby('date')['bottles_produced']
-                            .transform(lambda x: x == x.max()))
-    leaders = daily_prod[daily_prod['leader']]
-    fig_leader = px.scatter(
-        leaders, x='date', y='bottles_produced', color='plant',
-        labels={'bottles_produced': 'Daily Max Produced', 'plant': 'Leader'},
-        title='Plant Leading Daily Production'
-    )
+    daily = _grouped_sums(df, ['date', 'plant'], SUM_COLUMNS, filter_key, cache_dir)
+    leader = daily['bottles_produced'].eq(daily.groupby('date', sort=False)['bottles_produced'].transform('max'))
+    leaders = daily.loc[leader, ['date', 'plant', 'bottles_produced']]
+    def build():
+        fig_leader = px.scatter(
+            leaders, x='date', y='bottles_produced', color='plant',
+            labels={'bottles_produced': 'Daily Max Produced', 'plant': 'Leader'},
+            title='Plant Leading Daily Production',
+            render_mode='webgl'
+        )
+        return fig_leader
+    fig_leader = _figure('production_leaders', filter_key, build)
     st.plotly_chart(fig_leader, use_container_width=True)
     st.info("Shows which plant led daily production. Hover to see the plant and values.")
 
     st.subheader("Total Production by Plant (Sorted)")
-    grouped = df.groupby('plant')['bottles_produced'].sum().reset_index().sort_values(by='bottles_produced', ascending=False)
-    fig = px.bar(
-        grouped, x='plant', y='bottles_produced',
-        title='Total Production by Plant (Sorted)',
-        labels={'plant': 'Plant', 'bottles_produced': 'Total Bottles Produced'},
-        color='plant', color_discrete_sequence=px.colors.qualitative.Bold
-    )
-    fig.update_yaxes(range=[max(0, grouped['bottles_produced'].min() * 0.9), grouped['bottles_produced'].max() * 1.1])
+    grouped = _grouped_sums(df, 'plant', SUM_COLUMNS, filter_key, cache_dir)[['plant', 'bottles_produced']].sort_values(by='bottles_produced', ascending=False)
+    def build():
+        fig = px.bar(
+            grouped, x='plant', y='bottles_produced',
+            title='Total Production by Plant (Sorted)',
+            labels={'plant': 'Plant', 'bottles_produced': 'Total Bottles Produced'},
+            color='plant', color_discrete_sequence=px.colors.qualitative.Bold
+        )
+        fig.update_yaxes(range=[max(0, grouped['bottles_produced'].min() * 0.9), grouped['bottles_produced'].max() * 1.1])
+        return fig
+    fig = _figure('production_by_plant', filter_key, build)
     st.plotly_chart(fig, use_container_width=True)
     st.dataframe(grouped, use_container_width=True)
     max_plant = grouped.iloc[0]['plant']
     min_plant = grouped.iloc[-1]['plant']
     st.info(f"{max_plant} produced the most bottles overall, while {min_plant} produced the least.")
 
-def show_defect_comparison(df):
+def show_defect_comparison(df, filter_key=None, cache_dir=None):
     st.subheader("Who Had Most Defects Each Day?")
-    daily_defects = df.groupby(['date', 'plant'])['defect_count'].sum().reset_index()
-    daily_defects['leader'] = (daily_defects.groupby('date')['defect_count']
-                               .transform(lambda x: x == x.max()))
-    defect_leaders = daily_defects[daily_defects['leader']]
-    fig_def_leader = px.scatter(
-        defect_leaders, x='date', y='defect_count', color='plant',
-        labels={'defect_count': 'Daily Max Defects', 'plant': 'Leader'},
-        title='Plant with Most Defects Per Day'
-    )
+    daily = _grouped_sums(df, ['date', 'plant'], SUM_COLUMNS, filter_key, cache_dir)
+    leader = daily['defect_count'].eq(daily.groupby('date', sort=False)['defect_count'].transform('max'))
+    defect_leaders = daily.loc[leader, ['date', 'plant', 'defect_count']]
+    def build():
+        fig_def_leader = px.scatter(
+            defect_leaders, x='date', y='defect_count', color='plant',
+            labels={'defect_count': 'Daily Max Defects', 'plant': 'Leader'},
+            title='Plant with Most Defects Per Day',
+            render_mode='webgl'
+        )
+        return fig_def_leader
+    fig_def_leader = _figure('defect_leaders', filter_key, build)
     st.plotly_chart(fig_def_leader, use_container_width=True)
     st.info("Shows which plant had the most defects each day. Hover to see values.")
 
     st.subheader("Total Defects by Plant (Sorted)")
-    grouped = df.groupby('plant')['defect_count'].sum().reset_index().sort_values(by='defect_count', ascending=False)
-    fig = px.bar(
-        grouped, x='plant', y='defect_count',
-        title='Total Defects by Plant (Sorted)',
-        labels={'plant': 'Plant', 'defect_count': 'Total Defects'},
-        color='plant', color_discrete_sequence=px.colors.qualitative.Pastel
-    )
-    fig.update_yaxes(range=[max(0, grouped['defect_count'].min() * 0.9), grouped['defect_count'].max() * 1.1])
+    grouped = _grouped_sums(df, 'plant', SUM_COLUMNS, filter_key, cache_dir)[['plant', 'defect_count']].sort_values(by='defect_count', ascending=False)
+    def build():
+        fig = px.bar(
+            grouped, x='plant', y='defect_count',
+            title='Total Defects by Plant (Sorted)',
+            labels={'plant': 'Plant', 'defect_count': 'Total Defects'},
+            color='plant', color_discrete_sequence=px.colors.qualitative.Pastel
+        )
+        fig.update_yaxes(range=[max(0, grouped['defect_count'].min() * 0.9), grouped['defect_count'].max() * 1.1])
+        return fig
+    fig = _figure('defects_by_plant', filter_key, build)
     st.plotly_chart(fig, use_container_width=True)
     st.dataframe(grouped, use_container_width=True)
     max_plant = grouped.iloc[0]['plant']
     min_plant = grouped.iloc[-1]['plant']
     st.info(f"{max_plant} recorded the highest total defects, {min_plant} the least.")
 
-def show_monthly_metric_trends(df):
-    df['month'] = df['date'].dt.to_period('M').astype(str)
-    months_sorted = sorted(df['month'].unique(), key=lambda x: pd.Period(x, freq='M'))  # sort as periods not strings
+def _latest_month_leader(monthly, col):
+    # Only the latest month is reported, so find its top plant rather than every month's idxmax
+    latest = monthly[monthly['month'] == monthly['month'].iloc[-1]]
+    top = latest[col].idxmax()
+    return latest.at[top, 'month'], latest.at[top, 'plant'], latest.at[top, col]
+
+def show_monthly_metric_trends(df, filter_key=None):
+    # Group on a standalone month key so the caller's filtered frame isn't mutated or copied
+    month_key = _month_codes(df).rename('month')
+    months_sorted = _month_labels(np.sort(month_key.unique()))  # YYYYMM ints sort chronologically
+
+    # One (month, plant) pass feeds all three charts
+    monthly = df.groupby([month_key, 'plant'], observed=True)[list(SUM_COLUMNS)].sum().reset_index()
+    monthly['month'] = pd.Categorical(_month_labels(monthly['month']), categories=months_sorted, ordered=True)
+    monthly = monthly.sort_values('month')
 
     # Production
     st.subheader("Monthly Production by Plant")
-    prod_month = df.groupby(['month', 'plant'])['bottles_produced'].sum().reset_index()
-    prod_month['month'] = pd.Categorical(prod_month['month'], categories=months_sorted, ordered=True)
-    prod_month = prod_month.sort_values('month')
-    fig1 = px.bar(
-        prod_month, x='month', y='bottles_produced', color='plant',
-        barmode='group', labels={'bottles_produced': 'Total Produced', 'month': 'Month'},
-        title='Monthly Production by Plant', color_discrete_sequence=px.colors.qualitative.Bold,
-        category_orders={'month': months_sorted}
-    )
-    fig1.update_xaxes(type='category', categoryorder='array', categoryarray=months_sorted)
-    fig1.update_yaxes(rangemode='normal')  # Allow auto-scale for small variations
+    def build():
+        fig1 = px.bar(
+            monthly, x='month', y='bottles_produced', color='plant',
+            barmode='group', labels={'bottles_produced': 'Total Produced', 'month': 'Month'},
+            title='Monthly Production by Plant', color_discrete_sequence=px.colors.qualitative.Bold,
+            category_orders={'month': months_sorted}
+        )
+        fig1.update_xaxes(type='category', categoryorder='array', categoryarray=months_sorted)
+        fig1.update_yaxes(rangemode='normal')  # Allow auto-scale for small variations
+        return fig1
+    fig1 = _figure('monthly_production', filter_key, build)
     st.plotly_chart(fig1, use_container_width=True)
-    if not prod_month.empty:
-        top_prod_month = prod_month.loc[prod_month.groupby('month')['bottles_produced'].idxmax()]
-        month = top_prod_month['month'].iloc[-1]
-        plant = top_prod_month['plant'].iloc[-1]
-        val = top_prod_month['bottles_produced'].iloc[-1]
+    if not monthly.empty:
+        month, plant, val = _latest_month_leader(monthly, 'bottles_produced')
         st.info(f"In {month}, {plant} led production with {val:,} bottles produced.")
 
     # Defects
     st.subheader("Monthly Defects by Plant")
-    def_month = df.groupby(['month', 'plant'])['defect_count'].sum().reset_index()
-    def_month['month'] = pd.Categorical(def_month['month'], categories=months_sorted, ordered=True)
-    def_month = def_month.sort_values('month')
-    fig2 = px.bar(
-        def_month, x='month', y='defect_count', color='plant',
-        barmode='group', labels={'defect_count': 'Total Defects', 'month': 'Month'},
-        title='Monthly Defects by Plant', color_discrete_sequence=px.colors.qualitative.Pastel,
-        category_orders={'month': months_sorted}
-    )
-    fig2.update_xaxes(type='category', categoryorder='array', categoryarray=months_sorted)
-    fig2.update_yaxes(rangemode='normal')
+    def build():
+        fig2 = px.bar(
+            monthly, x='month', y='defect_count', color='plant',
+            barmode='group', labels={'defect_count': 'Total Defects', 'month': 'Month'},
+            title='Monthly Defects by Plant', color_discrete_sequence=px.colors.qualitative.Pastel,
+            category_orders={'month': months_sorted}
+        )
+        fig2.update_xaxes(type='category', categoryorder='array', categoryarray=months_sorted)
+        fig2.update_yaxes(rangemode='normal')
+        return fig2
+    fig2 = _figure('monthly_defects', filter_key, build)
     st.plotly_chart(fig2, use_container_width=True)
-    if not def_month.empty:
-        top_def_month = def_month.loc[def_month.groupby('month')['defect_count'].idxmax()]
-        month = top_def_month['month'].iloc[-1]
-        plant = top_def_month['plant'].iloc[-1]
-        val = top_def_month['defect_count'].iloc[-1]
+    if not monthly.empty:
+        month, plant, val = _latest_month_leader(monthly, 'defect_count')
         st.info(f"In {month}, {plant} had the most defects: {val:,}.")
 
     # Downtime
     st.subheader("Monthly Downtime by Plant")
-    dt_month = df.groupby(['month', 'plant'])['downtime'].sum().reset_index()
-    dt_month['month'] = pd.Categorical(dt_month['month'], categories=months_sorted, ordered=True)
-    dt_month = dt_month.sort_values('month')
-    fig3 = px.bar(
-        dt_month, x='month', y='downtime', color='plant',
-        barmode='group', labels={'downtime': 'Total Downtime (mins)', 'month': 'Month'},
-        title='Monthly Downtime by Plant', color_discrete_sequence=px.colors.qualitative.Set2,
-        category_orders={'month': months_sorted}
-    )
-    fig3.update_xaxes(type='category', categoryorder='array', categoryarray=months_sorted)
-    fig3.update_yaxes(rangemode='normal')
+    def build():
+        fig3 = px.bar(
+            monthly, x='month', y='downtime', color='plant',
+            barmode='group', labels={'downtime': 'Total Downtime (mins)', 'month': 'Month'},
+            title='Monthly Downtime by Plant', color_discrete_sequence=px.colors.qualitative.Set2,
+            category_orders={'month': months_sorted}
+        )
+        fig3.update_xaxes(type='category', categoryorder='array', categoryarray=months_sorted)
+        fig3.update_yaxes(rangemode='normal')
+        return fig3
+    fig3 = _figure('monthly_downtime', filter_key, build)
     st.plotly_chart(fig3, use_container_width=True)
-    if not dt_month.empty:
-        top_dt_month = dt_month.loc[dt_month.groupby('month')['downtime'].idxmax()]
-        month = top_dt_month['month'].iloc[-1]
-        plant = top_dt_month['plant'].iloc[-1]
-        val = top_dt_month['downtime'].iloc[-1]
+    if not monthly.empty:
+        month, plant, val = _latest_month_leader(monthly, 'downtime')
         st.info(f"In {month}, {plant} experienced the most downtime: {val:,.0f} mins.")
 
 
-def show_dayofweek_production(df):
-    dow_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    prod = df.groupby('day_of_week')['bottles_produced'].mean().reindex(dow_order)
-    fig1 = px.bar(
-        x=prod.index, y=prod.values, 
-        labels={'x': 'Day of Week', 'y': 'Avg Bottles Produced'},
-        title="Avg Production by Day",
-        color=prod.index, color_discrete_sequence=px.colors.qualitative.Bold
-    )
-    fig1.update_yaxes(range=[max(0, prod.min() * 0.9), prod.max() * 1.1])
-    st.plotly_chart(fig1, use_container_width=True)
-    max_prod_day = prod.idxmax()
-    min_prod_day = prod.idxmin()
+def show_dayofweek_production(df, filter_key=None):
+    prod = _weekday_means(df, filter_key)['bottles_produced']
+    def build():
+        fig = px.bar(
+            x=prod.index, y=prod.values, 
+            labels={'x': 'Day of Week', 'y': 'Avg Bottles Produced'},
+            title="Avg Production by Day",
+            color=prod.index, color_discrete_sequence=px.colors.qualitative.Bold
+        )
+        fig.update_yaxes(range=[max(0, prod.min() * 0.9), prod.max() * 1.1])
+        return fig
+    fig = _figure('dayofweek_production', filter_key, build)
+    st.plotly_chart(fig, use_container_width=True)
+    _, _, _, max_prod_day, min_prod_day = _extremes(prod.to_numpy(), prod.index)
     st.info(f"Production is highest on {max_prod_day} and lowest on {min_prod_day}.")
 
-def show_dayofweek_defects(df):
-    dow_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    defects = df.groupby('day_of_week')['defect_count'].mean().reindex(dow_order)
-    fig2 = px.bar(
-        x=defects.index, y=defects.values, 
-        labels={'x': 'Day of Week', 'y': 'Avg Defect Count'},
-        title="Avg Defects by Day",
-        color=defects.index, color_discrete_sequence=px.colors.qualitative.Pastel
-    )
-    fig2.update_yaxes(range=[max(0, defects.min() * 0.9), defects.max() * 1.1])
-    st.plotly_chart(fig2, use_container_width=True)
-    max_def_day = defects.idxmax()
-    min_def_day = defects.idxmin()
+def show_dayofweek_defects(df, filter_key=None):
+    defects = _weekday_means(df, filter_key)['defect_count']
+    def build():
+        fig = px.bar(
+            x=defects.index, y=defects.values, 
+            labels={'x': 'Day of Week', 'y': 'Avg Defect Count'},
+            title="Avg Defects by Day",
+            color=defects.index, color_discrete_sequence=px.colors.qualitative.Pastel
+        )
+        fig.update_yaxes(range=[max(0, defects.min() * 0.9), defects.max() * 1.1])
+        return fig
+    fig = _figure('dayofweek_defects', filter_key, build)
+    st.plotly_chart(fig, use_container_width=True)
+    _, _, _, max_def_day, min_def_day = _extremes(defects.to_numpy(), defects.index)
     st.info(f"Defects are highest on {max_def_day} and lowest on {min_def_day}.")
 
 def show_monthly_summary_table(df):
     st.subheader("Monthly Summary Table")
-    df['month'] = df['date'].dt.strftime('%Y-%m')
-    # Days in each month
-    days_per_month = df.groupby('month')['date'].nunique().reset_index(name='Days in Month')
-    # Highest producing plant per month
-    monthly_prod = df.groupby(['month', 'plant'])['bottles_produced'].sum().reset_index()
-    idx = monthly_prod.groupby('month')['bottles_produced'].idxmax()
-    top_plant_month = monthly_prod.loc[idx][['month', 'plant']].rename(columns={'plant': 'Top Plant'})
-    # Most defects in plant per month
-    monthly_def = df.groupby(['month', 'plant'])['defect_count'].sum().reset_index()
-    idx2 = monthly_def.groupby('month')['defect_count'].idxmax()
-    most_defect_plant = monthly_def.loc[idx2][['month', 'plant']].rename(columns={'plant': 'Most Defects Plant'})
-    # Highest/lowest downtime plant per month
-    monthly_dt = df.groupby(['month', 'plant'])['downtime'].sum().reset_index()
-    idx3 = monthly_dt.groupby('month')['downtime'].idxmax()
-    idx4 = monthly_dt.groupby('month')['downtime'].idxmin()
-    hi_dt_plant = monthly_dt.loc[idx3][['month', 'plant']].rename(columns={'plant': 'High Downtime Plant'})
-    lo_dt_plant = monthly_dt.loc[idx4][['month', 'plant']].rename(columns={'plant': 'Low Downtime Plant'})
-    # Aggregates
-    summary = df.groupby('month').agg({
-        'bottles_produced': 'mean',
-        'defect_count': 'mean',
-        'downtime': 'mean'
-    }).rename(columns={
-        'bottles_produced': 'Avg Production',
-        'defect_count': 'Avg Defects',
-        'downtime': 'Avg Downtime (mins)'
-    }).reset_index()
-    # Merge
-    summary = summary.merge(days_per_month, on='month')
-    summary = summary.merge(top_plant_month, on='month')
-    summary = summary.merge(most_defect_plant, on='month')
-    summary = summary.merge(hi_dt_plant, on='month')
-    summary = summary.merge(lo_dt_plant, on='month')
+    month_key = _month_codes(df).rename('month')  # standalone key, caller's frame untouched
+    # Monthly averages and day count in one pass over the rows
+    summary = df.groupby(month_key).agg(**{
+        'Avg Production': ('bottles_produced', 'mean'),
+        'Avg Defects': ('defect_count', 'mean'),
+        'Avg Downtime (mins)': ('downtime', 'mean'),
+        'Days in Month': ('date', 'nunique'),
+    })
+    # One (month, plant) pass; the per-month leaders come from this small frame
+    monthly = df.groupby([month_key, 'plant'], observed=True).agg(
+        prod=('bottles_produced', 'sum'), defects=('defect_count', 'sum'), downtime=('downtime', 'sum')
+    ).groupby(level='month')
+    leaders = pd.DataFrame({
+        'Top Plant': monthly['prod'].idxmax(),
+        'Most Defects Plant': monthly['defects'].idxmax(),
+        'High Downtime Plant': monthly['downtime'].idxmax(),
+        'Low Downtime Plant': monthly['downtime'].idxmin(),
+    }).apply(lambda col: col.str[1])  # idxmax/idxmin return (month, plant) labels
+    summary = pd.concat([summary, leaders], axis=1).reset_index()
+    summary['month'] = _month_labels(summary['month'])
     st.dataframe(summary, use_container_width=True)
     if not summary.empty:
         month = summary['month'].iloc[-1]
@@ -371,7 +571,7 @@ def show_monthly_summary_table(df):
             f"In {month}: {top_plant} had the highest average production, {defect_plant} saw the most average defects."
         )
         
-def show_kpi_insights(df):
+def show_kpi_insights(df, filter_key=None, cache_dir=None):
     st.subheader("KPI Highlights")
     if df.empty:
         st.write("No data available for insights.")
@@ -379,39 +579,55 @@ def show_kpi_insights(df):
 
     col1, col2 = st.columns(2)
     with col1:
-        show_plant_comparison(df)
+        show_plant_comparison(df, filter_key, cache_dir)
     with col2:
-        show_defect_comparison(df)
+        show_defect_comparison(df, filter_key, cache_dir)
 
     st.markdown("---")
-    show_monthly_metric_trends(df)
+    show_monthly_metric_trends(df, filter_key)
     st.markdown("---")
-    show_heatmap_defect_rates(df)
+    show_heatmap_defect_rates(df, filter_key, cache_dir)
     st.markdown("---")
-    show_downtime_contribution_by_shift(df)
+    show_downtime_contribution_by_shift(df, filter_key, cache_dir)
     st.markdown("---")
-    show_downtime_defect_correlation(df)
+    show_downtime_defect_correlation(df, filter_key, cache_dir)
     st.markdown("---")
 
-def show_downtime_contribution_by_shift(df):
+def show_downtime_contribution_by_shift(df, filter_key=None, cache_dir=None):
     st.subheader("Downtime Contribution by Shift")
-    grouped = df.groupby('shift')['downtime'].sum().reset_index()
-    fig = px.pie(grouped, names='shift', values='downtime', title='Share of Total Downtime by Shift', color_discrete_sequence=px.colors.qualitative.Set2)
+    grouped = _grouped_sums(df, 'shift', SUM_COLUMNS, filter_key, cache_dir)
+    fig = _figure('downtime_by_shift', filter_key, lambda: px.pie(
+        grouped, names='shift', values='downtime', title='Share of Total Downtime by Shift', color_discrete_sequence=px.colors.qualitative.Set2
+    ))
     st.plotly_chart(fig, use_container_width=True)
-    top_shift = grouped.loc[grouped['downtime'].idxmax(), 'shift']
+    top_shift = grouped['shift'].to_numpy()[grouped['downtime'].to_numpy().argmax()]
     st.info(f"Shift {top_shift} contributed the most to total downtime in minutes.")
 
-def show_downtime_defect_correlation(df):
+def _pearson_fit(x, y):
+    # Pearson r and the least-squares line from the same centred sums (no statsmodels regression)
+    xm = x - x.mean()
+    ym = y - y.mean()
+    sxy, sxx, syy = xm @ ym, xm @ xm, ym @ ym
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = sxy / sxx
+        return sxy / np.sqrt(sxx * syy), slope, y.mean() - slope * x.mean()
+
+def show_downtime_defect_correlation(df, filter_key=None, cache_dir=None):
     st.subheader("Downtime vs. Defects Correlation")
-    corr_df = df.groupby('date').agg({'downtime': 'sum', 'defect_count': 'sum'}).reset_index()
-    fig = px.scatter(
-        corr_df, x='downtime', y='defect_count',
-        labels={'downtime': 'Downtime (mins)', 'defect_count': 'Defects'},
-        title='Daily Downtime vs. Defects',
-        trendline="ols", color='defect_count', color_continuous_scale=px.colors.sequential.Bluered
-    )
+    corr_df = _daily_totals(df, filter_key, cache_dir)
+    corr_val, slope, intercept = _pearson_fit(corr_df['downtime'].to_numpy(np.float64), corr_df['defect_count'].to_numpy(np.float64))
+    def build():
+        fig = px.scatter(
+            corr_df, x='downtime', y='defect_count',
+            labels={'downtime': 'Downtime (mins)', 'defect_count': 'Defects'},
+            title='Daily Downtime vs. Defects',
+            color='defect_count', color_continuous_scale=px.colors.sequential.Bluered, render_mode='webgl'
+        )
+        x_ends = np.array([corr_df['downtime'].min(), corr_df['downtime'].max()])
+        fig.add_trace(go.Scattergl(x=x_ends, y=slope * x_ends + intercept, mode='lines', name='OLS trendline', showlegend=False))
+        return fig
+    fig = _figure('downtime_defect_correlation', filter_key, build)
     st.plotly_chart(fig, use_container_width=True)
-    corr_val = corr_df['downtime'].corr(corr_df['defect_count'])
     abs_corr = abs(corr_val)
     if abs_corr > 0.7:
         relation = "strong"